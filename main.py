@@ -4,17 +4,27 @@
 # ==============================================================================
 import os
 import random
-import subprocess
 import json
+import html
 import time
 import threading
+import queue
+import heapq
+import secrets
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 import shutil
-from datetime import datetime
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from cachetools import TTLCache, cached
+import yt_dlp
 from instagrapi import Client
 from instagrapi.exceptions import LoginRequired, ChallengeRequired, UserNotFound
-from apscheduler.schedulers.background import BackgroundScheduler
 from dotenv import load_dotenv
 import requests
+import orjson
+from requests_toolbelt import MultipartEncoder
 import logging
 
 # ==============================================================================
@@ -55,11 +65,44 @@ ADMIN_USER_ID = int(ADMIN_USER_ID)
 
 REELS_FOLDER = os.path.join(DATA_PATH, "reels")
 SESSION_FILE = os.path.join(DATA_PATH, f"{USERNAME}_session.json")
-APPROVAL_FILE = os.path.join(DATA_PATH, "approval_flags.json")
-DEMO_FILE = os.path.join(DATA_PATH, "demo_flags.json")
+_REELS_READY = False  # set once REELS_FOLDER has been created at startup
+# Telegram button presses are handed to wait_for_decision through one single-slot queue per prompt, so each tap is consumed by exactly one waiter.
+DECISION_QUEUES = {"demo": queue.Queue(maxsize=1), "demo_approval": queue.Queue(maxsize=1), "upload_approval": queue.Queue(maxsize=1)}
+# Inline keyboards are serialized once here and passed to Telegram as ready-made reply_markup strings.
+DEMO_KEYBOARD = json.dumps({"inline_keyboard": [[{"text": "✅ Run Demo", "callback_data": "run_demo"}, {"text": "⏭️ Skip", "callback_data": "skip_demo"}]]})
+APPROVE_DEMO_KB = json.dumps({"inline_keyboard": [[{"text": "✅ Approve", "callback_data": "approve_demo"}, {"text": "❌ Reject", "callback_data": "reject_demo"}]]})
+APPROVE_UPLOAD_KB = json.dumps({"inline_keyboard": [[{"text": "✅ Approve", "callback_data": "approve_upload"}, {"text": "❌ Reject", "callback_data": "reject_upload"}]]})
 SOURCE_ACCOUNTS = ["terabox_links.hub", "divya_links", "duniyaa_links_ki", "mx_links"]
 cl, last_update_id = Client(), 0
 
+# One keep-alive session for every Telegram call so the TLS connection is reused.
+TG_API = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}"
+TG_SESSION = requests.Session()
+TG_SESSION.headers.update({"Connection": "keep-alive", "Accept-Encoding": "gzip"})
+JSON_HEADERS = {"Content-Type": "application/json"}
+
+# Plain notifications are buffered and flushed as one message every TG_FLUSH_INTERVAL seconds.
+TG_MSG_LIMIT, TG_FLUSH_INTERVAL = 4096, 2
+_msg_buf, _msg_lock = queue.Queue(maxsize=100), threading.Lock()
+
+# Set TELEGRAM_WEBHOOK_URL (public HTTPS URL routed to PORT) to receive updates by webhook instead of long polling.
+WEBHOOK_URL = os.getenv("TELEGRAM_WEBHOOK_URL")
+WEBHOOK_PORT = os.getenv("PORT", "8080")
+WEBHOOK_SECRET = secrets.token_urlsafe(32)
+
+# In-process yt-dlp (no per-reel subprocess). YoutubeDL is not thread-safe, so each thread of the long-lived
+# DOWNLOAD_POOL builds one instance on first use and reuses it for every later download.
+YDL_OPTS = {"format": "b[ext=mp4]/b/best", "outtmpl": os.path.join(REELS_FOLDER, "%(id)s.%(ext)s"), "quiet": True, "no_warnings": True, "socket_timeout": 180, "concurrent_fragment_downloads": 4}
+# Opt-in: hand fragments to aria2c with 4 connections per file when USE_ARIA2C=1 and it is installed.
+if os.getenv("USE_ARIA2C") == "1" and shutil.which("aria2c"):
+    YDL_OPTS.update({"external_downloader": {"default": "aria2c"}, "external_downloader_args": {"aria2c": ["-x", "4", "-s", "4"]}})
+_ydl_local = threading.local()
+DOWNLOAD_POOL = ThreadPoolExecutor(max_workers=4, thread_name_prefix="reel-download")
+
+def get_ydl():
+    if not hasattr(_ydl_local, "ydl"): _ydl_local.ydl = yt_dlp.YoutubeDL(YDL_OPTS)
+    return _ydl_local.ydl
+
 # ==============================================================================
 #          ALL BOT FUNCTIONS (login, download, upload, etc.)
 # ==============================================================================
@@ -68,21 +111,21 @@ def robust_login(max_retries=3):
     for attempt in range(max_retries):
         try:
             if os.path.exists(SESSION_FILE):
-                logger.info(f"Attempting to load session from persistent storage: {SESSION_FILE}...")
+                logger.info("Attempting to load session from persistent storage: %s...", SESSION_FILE)
                 cl.load_settings(SESSION_FILE)
                 cl.login(USERNAME, PASSWORD)
                 cl.get_timeline_feed()
-                logger.info(f"Logged in successfully as {cl.username} using existing session.")
+                logger.info("Logged in successfully as %s using existing session.", cl.username)
                 return True
-        except Exception as e: logger.warning(f"Session load failed: {e}. Attempting fresh login.")
+        except Exception as e: logger.warning("Session load failed: %s. Attempting fresh login.", e)
         try:
-            logger.info(f"Attempting fresh login (attempt {attempt + 1}/{max_retries})...")
+            logger.info("Attempting fresh login (attempt %s/%s)...", attempt + 1, max_retries)
             cl.login(USERNAME, PASSWORD)
             cl.dump_settings(SESSION_FILE)
-            logger.info(f"Fresh login successful for {cl.username}. Session saved to {SESSION_FILE}")
+            logger.info("Fresh login successful for %s. Session saved to %s", cl.username, SESSION_FILE)
             return True
         except Exception as e:
-            logger.error(f"Login attempt {attempt + 1} failed: {e}")
+            logger.error("Login attempt %s failed: %s", attempt + 1, e)
             if "checkpoint_required" in str(e).lower():
                 logger.critical("CRITICAL: Challenge required.")
                 send_telegram_message("⚠️ <b>Login Failed:</b> Checkpoint required.")
@@ -91,93 +134,158 @@ def robust_login(max_retries=3):
     logger.error("All login attempts have failed.")
     return False
 
-def send_telegram_message(text, reply_markup=None):
+def _post_telegram_message(text, reply_markup: str = None):
     try:
-        url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/sendMessage"
+        url = f"{TG_API}/sendMessage"
         payload = {"chat_id": TELEGRAM_CHAT_ID, "text": text, "parse_mode": "HTML"}
-        if reply_markup: payload["reply_markup"] = json.dumps(reply_markup)
-        requests.post(url, json=payload, timeout=10)
-    except Exception as e: logger.error(f"Failed to send Telegram message: {e}")
+        if reply_markup: payload["reply_markup"] = reply_markup
+        response = TG_SESSION.post(url, data=orjson.dumps(payload), headers=JSON_HEADERS, timeout=10)
+        if response.ok: return True
+        logger.error("Telegram rejected message (%s): %s", response.status_code, response.text)
+    except Exception as e: logger.error("Failed to send Telegram message: %s", e)
+    return False
+
+def flush_telegram_messages():
+    """Drains the buffer and sends it as few newline-joined messages as the 4096-char limit allows."""
+    with _msg_lock:
+        chunks = []
+        while True:
+            try: text = _msg_buf.get_nowait()
+            except queue.Empty: break
+            for piece in (text[i:i + TG_MSG_LIMIT] for i in range(0, len(text), TG_MSG_LIMIT)):
+                if chunks and sum(len(p) + 1 for p in chunks[-1]) + len(piece) <= TG_MSG_LIMIT: chunks[-1].append(piece)
+                else: chunks.append([piece])
+        for pieces in chunks:
+            # A rejected batch is resent piece by piece so one bad message cannot hide the others.
+            if not _post_telegram_message("\n".join(pieces)) and len(pieces) > 1:
+                for piece in pieces: _post_telegram_message(piece)
+
+def telegram_flusher():
+    while True:
+        time.sleep(TG_FLUSH_INTERVAL)
+        flush_telegram_messages()
 
-def send_telegram_video(video_path, caption="", reply_markup=None):
+def send_telegram_message(text, reply_markup: str = None, flush_now=False):
+    # Button prompts and fatal errors go out immediately, after anything already buffered.
+    if reply_markup or flush_now:
+        flush_telegram_messages()
+        return _post_telegram_message(text, reply_markup)
+    try: _msg_buf.put_nowait(text)
+    except queue.Full:
+        flush_telegram_messages()
+        _post_telegram_message(text)
+
+def send_telegram_video(video_path, caption="", reply_markup: str = None):
+    flush_telegram_messages()
     try:
-        url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/sendVideo"
+        url = f"{TG_API}/sendVideo"
         with open(video_path, "rb") as video_file:
-            files, data = {"video": video_file}, {"chat_id": TELEGRAM_CHAT_ID, "caption": caption, "parse_mode": "HTML"}
-            if reply_markup: data["reply_markup"] = json.dumps(reply_markup)
-            response = requests.post(url, data=data, files=files, timeout=60)
+            # Streamed multipart body: the reel is read in small chunks instead of being buffered whole in memory.
+            fields = {"chat_id": TELEGRAM_CHAT_ID, "caption": caption, "parse_mode": "HTML", "video": (os.path.basename(video_path), video_file, "video/mp4")}
+            if reply_markup: fields["reply_markup"] = reply_markup
+            enc = MultipartEncoder(fields=fields)
+            response = TG_SESSION.post(url, data=enc, headers={"Content-Type": enc.content_type}, timeout=120)
             response.raise_for_status()
             return response.json()
     except Exception as e:
-        logger.error(f"Failed to send Telegram video: {e}")
-        send_telegram_message(f"⚠️ <b>Error:</b> Failed to send video preview. <code>{e}</code>")
+        logger.error("Failed to send Telegram video: %s", e)
+        send_telegram_message(f"⚠️ <b>Error:</b> Failed to send video preview. <code>{html.escape(str(e))}</code>")
         return None
 
-def wait_for_decision(flag_file, timeout=300):
-    start_time = time.time()
-    while time.time() - start_time < timeout:
-        if os.path.exists(flag_file):
-            try:
-                with open(flag_file, 'r') as f: flags = json.load(f)
-                if "decision" in flags:
-                    os.remove(flag_file)
-                    return flags["decision"]
-            except (json.JSONDecodeError, IOError): time.sleep(1); continue
-        time.sleep(5)
-    if os.path.exists(flag_file): os.remove(flag_file)
+def reset_decision(prompt):
+    """Discards stale taps; call before sending the prompt so a fast tap is not lost."""
+    try: DECISION_QUEUES[prompt].get_nowait()
+    except queue.Empty: pass
+
+def wait_for_decision(prompt, timeout=300):
+    try: return DECISION_QUEUES[prompt].get(timeout=timeout)
+    except queue.Empty: return None
+
+@lru_cache(maxsize=32)
+def _uid(name):
+    # SOURCE_ACCOUNTS is static, so each username is resolved against Instagram only once.
+    return cl.user_id_from_username(name)
+
+# Reuse a source's top-20 list for an hour, so downloads close together (e.g. the startup demo followed by a
+# scheduled or daily run) do not fetch the same list from Instagram again.
+# TTLCache mutates on reads (expiry) and download_reels can run on several threads, so all access goes through the lock.
+_MEDIA_CACHE, _MEDIA_CACHE_LOCK = TTLCache(maxsize=32, ttl=3600), threading.Lock()
+
+@cached(_MEDIA_CACHE, lock=_MEDIA_CACHE_LOCK)
+def _medias(uid):
+    return cl.user_medias(uid, amount=20)
+
+def _list_reels():
+    return [e.path for e in os.scandir(REELS_FOLDER) if e.is_file() and e.name.endswith(".mp4")]
+
+def _download_one(reel):
+    name = f"{reel.user.username}_{reel.pk}"
+    filename = os.path.join(REELS_FOLDER, f"{name}.mp4")
+    # Instagram serves reels as a pre-muxed MP4, so fetch it directly; yt-dlp is only the fallback.
+    if reel.video_url:
+        try:
+            path = cl.video_download_by_url(str(reel.video_url), filename=name, folder=REELS_FOLDER)
+            if str(path) != filename: os.replace(path, filename)
+            return filename
+        except Exception as e: logger.warning("Direct download failed for reel %s, falling back to yt-dlp: %s", reel.code, e)
+    try:
+        reel_url = f"https://www.instagram.com/reel/{reel.code}/"
+        logger.info("Downloading reel from: %s", reel_url)
+        info = get_ydl().extract_info(reel_url, download=True)
+        os.replace(info["requested_downloads"][0]["filepath"], filename)
+        return filename
+    except yt_dlp.utils.DownloadError as e: logger.error("yt-dlp failed for reel %s: %s", reel.code, e)
+    except Exception as e: logger.error("Failed to download a specific reel (%s): %s", reel.code, e)
     return None
 
 def download_reels(num_reels=3, is_demo=False):
+    """Clears REELS_FOLDER, downloads up to num_reels reels into it and returns their paths ([] on failure)."""
     if not cl.user_id:
         send_telegram_message("⚠️ Download failed: Not logged into Instagram.")
-        return False
-    os.makedirs(REELS_FOLDER, exist_ok=True)
-    for f in os.listdir(REELS_FOLDER): os.remove(os.path.join(REELS_FOLDER, f))
+        return []
+    if not _REELS_READY: os.makedirs(REELS_FOLDER, exist_ok=True)
+    with os.scandir(REELS_FOLDER) as it:
+        for e in it:
+            if e.is_file(): os.unlink(e.path)
     account = random.choice(SOURCE_ACCOUNTS)
     send_telegram_message(f"🔍 <b>{'DEMO: ' if is_demo else ''}Download Started</b>\nFinding reels from <code>@{account}</code>...")
     try:
-        medias = cl.user_medias(cl.user_id_from_username(account), amount=20)
+        user_id = _uid(account)
+        medias = _medias(user_id)
         reels = [m for m in medias if m.media_type == 2]
         if not reels: raise Exception(f"No recent reels found for @{account}.")
-        random.shuffle(reels)
-        reels_to_download, download_count = reels[:num_reels], 0
-        for reel in reels_to_download:
-            try:
-                reel_url, filename = f"https://www.instagram.com/reel/{reel.code}/", os.path.join(REELS_FOLDER, f"{reel.user.username}_{reel.pk}.mp4")
-                logger.info(f"Downloading reel from: {reel_url}")
-                command = ["yt-dlp", "-f", "bestvideo+bestaudio/best", "--merge-output-format", "mp4", "--no-warnings", "--quiet", "-o", filename, reel_url]
-                result = subprocess.run(command, capture_output=True, text=True, timeout=180, check=True)
-                download_count += 1
-            except subprocess.CalledProcessError as e: logger.error(f"yt-dlp failed for reel {reel.code}. Stderr: {e.stderr.strip()}")
-            except Exception as e: logger.error(f"Failed to download a specific reel ({reel.code}): {e}")
-        if download_count == 0: raise Exception(f"All download attempts failed for @{account}.")
-        send_telegram_message(f"✅ <b>Download Complete:</b> {download_count} reel(s) downloaded.")
-        return True
+        reels_to_download = random.sample(reels, k=min(num_reels, len(reels)))
+        paths = [p for p in DOWNLOAD_POOL.map(_download_one, reels_to_download) if p]
+        if not paths: raise Exception(f"All download attempts failed for @{account}.")
+        send_telegram_message(f"✅ <b>Download Complete:</b> {len(paths)} reel(s) downloaded.")
+        return paths
     except UserNotFound:
+        _uid.cache_clear()
+        with _MEDIA_CACHE_LOCK: _MEDIA_CACHE.clear()
         send_telegram_message(f"⚠️ <b>Download Error:</b> User @{account} not found.")
-        return False
+        return []
     except Exception as e:
-        logger.error(f"Download process failed: {e}", exc_info=True)
-        send_telegram_message(f"⚠️ <b>Download Error:</b>\n<code>{e}</code>")
-        return False
+        logger.error("Download process failed: %s", e, exc_info=True)
+        send_telegram_message(f"⚠️ <b>Download Error:</b>\n<code>{html.escape(str(e))}</code>")
+        return []
 
 def comment_on_sources(source_account, media_pk):
     try:
         cl.media_comment(media_pk, text=f"Great reel! Reposted with credit on @{cl.username} 🔥")
-        logger.info(f"Successfully commented on source reel from @{source_account}")
+        logger.info("Successfully commented on source reel from @%s", source_account)
         send_telegram_message(f"✅ Left a credit comment on original reel from <b>@{source_account}</b>.")
-    except Exception as e: logger.error(f"Could not comment on source @{source_account}: {e}")
+    except Exception as e: logger.error("Could not comment on source @%s: %s", source_account, e)
 
 def upload_reel(path, source_account, media_pk):
     try:
         cl.clip_upload(path, caption=f"Credits to @{source_account} 🔥\nFollow for more!")
-        logger.info(f"Successfully uploaded reel from {path}")
+        logger.info("Successfully uploaded reel from %s", path)
         send_telegram_message(f"✅ <b>Reel Posted!</b>\nSource: <code>@{source_account}</code>")
         comment_on_sources(source_account, media_pk)
         return True
     except Exception as e:
-        logger.error(f"Upload failed: {e}", exc_info=True)
-        send_telegram_message(f"⚠️ <b>Upload Error:</b>\n<code>{e}</code>")
+        logger.error("Upload failed: %s", e, exc_info=True)
+        send_telegram_message(f"⚠️ <b>Upload Error:</b>\n<code>{html.escape(str(e))}</code>")
         return False
     finally:
         if os.path.exists(path): os.remove(path)
@@ -185,32 +293,31 @@ def upload_reel(path, source_account, media_pk):
 def perform_demo():
     try:
         send_telegram_message("⚙️ <b>Demo Mode</b>\nDownloading test reel...")
-        if not download_reels(num_reels=1, is_demo=True):
+        reels = download_reels(num_reels=1, is_demo=True)
+        if not reels:
             send_telegram_message("⚠️ <b>Demo Halted:</b> Download failed.")
             return
-        reels = [f for f in os.listdir(REELS_FOLDER) if f.endswith(".mp4")]
-        if not reels: return
-        reel_path = os.path.join(REELS_FOLDER, reels[0])
-        source_account, media_pk, _ = reels[0].replace(".mp4", "").partition('_')
-        send_telegram_video(reel_path, "📹 <b>DEMO: APPROVE POST?</b>", reply_markup={"inline_keyboard": [[{"text": "✅ Approve", "callback_data": "approve_demo"}, {"text": "❌ Reject", "callback_data": "reject_demo"}]]})
-        with open(APPROVAL_FILE, 'w') as f: json.dump({}, f)
-        decision = wait_for_decision(APPROVAL_FILE, timeout=600)
+        reel_path = reels[0]
+        source_account, media_pk, _ = os.path.basename(reel_path).replace(".mp4", "").partition('_')
+        reset_decision("demo_approval")
+        send_telegram_video(reel_path, "📹 <b>DEMO: APPROVE POST?</b>", reply_markup=APPROVE_DEMO_KB)
+        decision = wait_for_decision("demo_approval", timeout=600)
         if decision is True: upload_reel(reel_path, source_account, media_pk); send_telegram_message("✅ <b>Demo Completed Successfully!</b>")
         elif decision is False: send_telegram_message("👎 <b>Demo Rejected.</b>")
         else: send_telegram_message("⏳ <b>Demo Timed Out.</b>")
         if os.path.exists(reel_path): os.remove(reel_path)
-    except Exception as e: logger.error(f"Demo error: {e}", exc_info=True)
+    except Exception as e: logger.error("Demo error: %s", e, exc_info=True)
 
 def scheduled_job():
     logger.info("--- Running Scheduled Job ---")
-    reels = [f for f in os.listdir(REELS_FOLDER) if f.endswith(".mp4")]
-    if not reels: daily_download_job(); reels = [f for f in os.listdir(REELS_FOLDER) if f.endswith(".mp4")];
+    reels = _list_reels()
+    if not reels: daily_download_job(); reels = _list_reels()
     if not reels: return
-    reel_path = os.path.join(REELS_FOLDER, random.choice(reels))
+    reel_path = random.choice(reels)
     source_account, media_pk, _ = os.path.basename(reel_path).replace(".mp4", "").partition('_')
-    send_telegram_video(reel_path, f"📹 <b>APPROVE POST?</b>\nSource: @{source_account}", reply_markup={"inline_keyboard": [[{"text": "✅ Approve", "callback_data": "approve_upload"}, {"text": "❌ Reject", "callback_data": "reject_upload"}]]})
-    with open(APPROVAL_FILE, 'w') as f: json.dump({}, f)
-    decision = wait_for_decision(APPROVAL_FILE, timeout=1800)
+    reset_decision("upload_approval")
+    send_telegram_video(reel_path, f"📹 <b>APPROVE POST?</b>\nSource: @{source_account}", reply_markup=APPROVE_UPLOAD_KB)
+    decision = wait_for_decision("upload_approval", timeout=1800)
     if decision is True: upload_reel(reel_path, source_account, media_pk)
     elif decision is False: send_telegram_message("👎 <b>Upload Rejected.</b>")
     else: send_telegram_message("⏳ <b>Approval Timed Out.</b>")
@@ -225,12 +332,14 @@ def process_telegram_update(update):
     if "callback_query" not in update: return
     cb = update["callback_query"]
     if cb["from"]["id"] != ADMIN_USER_ID: return
-    flag_file, decision = None, None
-    if cb["data"] in ["run_demo", "skip_demo"]: flag_file, decision = DEMO_FILE, (cb["data"] == "run_demo")
-    elif cb["data"] in ["approve_demo", "reject_demo", "approve_upload", "reject_upload"]: flag_file, decision = APPROVAL_FILE, cb["data"].startswith("approve")
-    if flag_file and os.path.exists(flag_file):
-        with open(flag_file, "r+") as f: data = json.load(f); data["decision"] = decision; f.seek(0); json.dump(data, f); f.truncate()
-    requests.post(f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/answerCallbackQuery", json={"callback_query_id": cb["id"]})
+    prompt, decision = None, None
+    if cb["data"] in ["run_demo", "skip_demo"]: prompt, decision = "demo", (cb["data"] == "run_demo")
+    elif cb["data"] in ["approve_demo", "reject_demo"]: prompt, decision = "demo_approval", (cb["data"] == "approve_demo")
+    elif cb["data"] in ["approve_upload", "reject_upload"]: prompt, decision = "upload_approval", (cb["data"] == "approve_upload")
+    if prompt:
+        try: DECISION_QUEUES[prompt].put_nowait(decision)
+        except queue.Full: pass  # an earlier tap on this prompt is still pending
+    TG_SESSION.post(f"{TG_API}/answerCallbackQuery", data=orjson.dumps({"callback_query_id": cb["id"]}), headers=JSON_HEADERS)
 
 # ==============================================================================
 #                      *** FUNCTION WITH THE FIX ***
@@ -239,55 +348,102 @@ def poll_telegram_updates():
     """Continuously polls Telegram for new messages and callbacks."""
     global last_update_id
     logger.info("Starting Telegram polling...")
+    try: TG_SESSION.post(f"{TG_API}/deleteWebhook", timeout=10)
+    except requests.exceptions.RequestException as e: logger.warning("Could not clear Telegram webhook: %s", e)
+    url = f"{TG_API}/getUpdates"
     while True:
         try:
-            url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/getUpdates"
             # CORRECTED: Define params first on its own line.
             params = {"offset": last_update_id + 1, "timeout": 30}
             # CORRECTED: Use the defined params variable in the request.
-            response = requests.get(url, params=params, timeout=35)
+            response = TG_SESSION.get(url, params=params, timeout=35)
             response.raise_for_status() # Raise an exception for bad status codes (4xx or 5xx)
-            updates = response.json().get("result", [])
+            updates = orjson.loads(response.content).get("result", [])
             for update in updates:
                 process_telegram_update(update)
                 last_update_id = update["update_id"]
         # IMPROVED: Catch specific network errors first.
         except requests.exceptions.RequestException as e:
-            logger.error(f"Telegram polling network error: {e}")
+            logger.error("Telegram polling network error: %s", e)
             time.sleep(15) # Wait longer on network issues
         # Cacth all other potential errors
         except Exception as e:
-            logger.error(f"An unexpected error occurred in poll_telegram_updates: {e}")
+            logger.error("An unexpected error occurred in poll_telegram_updates: %s", e)
             time.sleep(10)
 
+class TelegramWebhookHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        if not secrets.compare_digest(self.headers.get("X-Telegram-Bot-Api-Secret-Token", "").encode(), WEBHOOK_SECRET.encode()):
+            self.send_response(403); self.end_headers()
+            return
+        try: process_telegram_update(orjson.loads(self.rfile.read(int(self.headers.get("Content-Length", 0)))))
+        except Exception as e: logger.error("Failed to process webhook update: %s", e)
+        self.send_response(200); self.end_headers()
+
+    def log_message(self, format, *args): pass
+
+def serve_telegram_webhook():
+    """Registers the webhook with Telegram and serves pushed updates; falls back to polling if binding or registration fails."""
+    try: server = ThreadingHTTPServer(("0.0.0.0", int(WEBHOOK_PORT)), TelegramWebhookHandler)
+    except (OSError, ValueError) as e:
+        logger.error("Could not bind webhook server on port %s, falling back to polling: %s", WEBHOOK_PORT, e)
+        return poll_telegram_updates()
+    try:
+        payload = {"url": WEBHOOK_URL, "secret_token": WEBHOOK_SECRET, "allowed_updates": ["callback_query"]}
+        TG_SESSION.post(f"{TG_API}/setWebhook", json=payload, timeout=10).raise_for_status()
+    except requests.exceptions.RequestException as e:
+        logger.error("Webhook registration failed, falling back to polling: %s", e)
+        server.server_close()
+        return poll_telegram_updates()
+    logger.info("Serving Telegram webhook on port %s...", WEBHOOK_PORT)
+    server.serve_forever()
+
+# ==============================================================================
+#                                 SCHEDULER
+# ==============================================================================
+IST = ZoneInfo("Asia/Kolkata")
+# (job, [(hour, minute), ...]) fire times in IST.
+JOB_SCHEDULE = [(scheduled_job, [(8, 0), (14, 0), (20, 0)]), (daily_download_job, [(0, 5)])]
+
+def next_trigger(times, after=None):
+    """Returns the timestamp of the first fire time strictly after `after` (default: now)."""
+    now = datetime.fromtimestamp(after or time.time(), IST)
+    candidates = [now.replace(hour=h, minute=m, second=0, microsecond=0) + timedelta(days=d) for d in (0, 1) for h, m in times]
+    return min(c for c in candidates if c > now).timestamp()
+
+def run_scheduler():
+    """Sleeps until the earliest due job, runs it on its own thread and re-queues its next fire time."""
+    heap = [(next_trigger(times), i, job, times) for i, (job, times) in enumerate(JOB_SCHEDULE)]
+    heapq.heapify(heap)
+    while True:
+        ts, i, job, times = heapq.heappop(heap)
+        time.sleep(max(0, ts - time.time()))
+        threading.Thread(target=job, daemon=True).start()
+        heapq.heappush(heap, (next_trigger(times, ts), i, job, times))
+
 # ==============================================================================
 #                             MAIN EXECUTION BLOCK
 # ==============================================================================
 if __name__ == "__main__":
     if not check_dependencies(): exit(1)
-    scheduler = None
+    threading.Thread(target=telegram_flusher, daemon=True).start()
     try:
-        os.makedirs(REELS_FOLDER, exist_ok=True)
+        os.makedirs(REELS_FOLDER, exist_ok=True); _REELS_READY = True
         if not robust_login():
-            send_telegram_message("❌ <b>Fatal Error:</b> Bot could not log in and is shutting down.")
+            send_telegram_message("❌ <b>Fatal Error:</b> Bot could not log in and is shutting down.", flush_now=True)
             exit(1)
         send_telegram_message("✅ <b>Bot Online & Logged In!</b>")
-        polling_thread = threading.Thread(target=poll_telegram_updates, daemon=True)
-        polling_thread.start()
-        scheduler = BackgroundScheduler(timezone="Asia/Kolkata")
-        scheduler.add_job(scheduled_job, 'cron', hour='8,14,20', misfire_grace_time=3600)
-        scheduler.add_job(daily_download_job, 'cron', hour=0, minute=5, misfire_grace_time=3600)
-        scheduler.start()
-        send_telegram_message("🛠️ <b>Bot Started!</b> Run a demo?", reply_markup={"inline_keyboard": [[{"text": "✅ Run Demo", "callback_data": "run_demo"}, {"text": "⏭️ Skip", "callback_data": "skip_demo"}]]})
-        with open(DEMO_FILE, 'w') as f: json.dump({}, f)
-        decision = wait_for_decision(DEMO_FILE, timeout=300)
+        updates_thread = threading.Thread(target=serve_telegram_webhook if WEBHOOK_URL else poll_telegram_updates, daemon=True)
+        updates_thread.start()
+        threading.Thread(target=run_scheduler, daemon=True).start()
+        reset_decision("demo")
+        send_telegram_message("🛠️ <b>Bot Started!</b> Run a demo?", reply_markup=DEMO_KEYBOARD)
+        decision = wait_for_decision("demo", timeout=300)
         if decision is True: perform_demo()
         logger.info("Bot is fully operational.")
-        polling_thread.join()
+        updates_thread.join()
     except (KeyboardInterrupt, SystemExit):
-        if scheduler and scheduler.running: scheduler.shutdown()
-        send_telegram_message("⏸️ <b>Bot shutting down.</b>")
+        send_telegram_message("⏸️ <b>Bot shutting down.</b>", flush_now=True)
     except Exception as e:
-        logger.critical(f"A fatal error occurred: {e}", exc_info=True)
-        if scheduler and scheduler.running: scheduler.shutdown()
-        send_telegram_message(f"❌ <b>FATAL ERROR:</b> <code>{e}</code>")
+        logger.critical("A fatal error occurred: %s", e, exc_info=True)
+        send_telegram_message(f"❌ <b>FATAL ERROR:</b> <code>{html.escape(str(e))}</code>", flush_now=True)